@@ -1,17 +1,27 @@
 # coding: utf-8
 # vim:sw=4:ts=4:et:
 """Python Ring Doorbell wrapper."""
+import logging
+import threading
+import time
+from copy import deepcopy
+import requests
+from requests.adapters import HTTPAdapter
+
 try:
-    from urllib.parse import urlencode
+    from time import monotonic
 except ImportError:
-    from urllib import urlencode
+    from time import time as monotonic
 
-from datetime import timedelta
-from datetime import datetime as dt
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
-import logging
-import time
-import requests
+try:
+    from concurrent.futures import ThreadPoolExecutor
+except ImportError:
+    ThreadPoolExecutor = None
 
 from ring_doorbell.utils import _exists_cache, _save_cache, _read_cache
 
@@ -19,12 +29,14 @@ from ring_doorbell.const import (
     API_VERSION, API_URI, CACHE_ATTRS, CACHE_FILE,
     DEVICES_ENDPOINT, HEADERS, NEW_SESSION_ENDPOINT, MSG_GENERIC_FAIL,
     POST_DATA, PERSIST_TOKEN_ENDPOINT, PERSIST_TOKEN_DATA, RETRY_TOKEN,
-    TIMEOUT)
+    TIMEOUT, TOKEN_EXPIRY_MARGIN, POOL_CONNECTIONS, POOL_MAXSIZE,
+    DEVICES_CACHE_TTL, UPDATE_WORKERS)
 
 from ring_doorbell.doorbot import RingDoorBell
 from ring_doorbell.chime import RingChime
 from ring_doorbell.stickup_cam import RingStickUpCam
 from ring_doorbell.auth import Auth
+from ring_doorbell.http2 import HTTP2Session
 
 
 _LOGGER = logging.getLogger(__name__)
@@ -34,13 +46,26 @@ _LOGGER = logging.getLogger(__name__)
 class Ring(object):
     """A Python Abstraction object to Ring Door Bell."""
 
+    # JSON keys of the devices payload and the classes built from them,
+    # shared doorbells are read-only
+    _DEVICE_SPECS = {
+        'chimes': (('chimes', RingChime, {}),),
+        'stickup_cams': (('stickup_cams', RingStickUpCam, {}),),
+        'doorbells': (('doorbots', RingDoorBell, {}),
+                      ('authorized_doorbots', RingDoorBell,
+                       {'shared': True})),
+    }
+
     def __init__(self, username, password,
                  auth_callback=None,
                  debug=False, persist_token=False,
                  push_token_notify_url="http://localhost/", reuse_session=True,
-                 cache_file=CACHE_FILE, timeout=TIMEOUT):
+                 cache_file=CACHE_FILE, timeout=TIMEOUT, http2=False,
+                 lazy=False):
         """Initialize the Ring object.
         :type auth_callback: Callable[[], str]
+        :type http2: bool
+        :type lazy: bool
         """
         self.is_connected = None
         self.token = None
@@ -52,23 +77,77 @@ class Ring(object):
         self.debug = debug
         self.username = username
         self.password = password
-        self.session = requests.Session()
+        self.session = None
+        self._http2 = http2
 
         self.auth_callback = auth_callback
         self.auth = None
         self.last_refresh = None
+        self._access_token = None
+        self._access_token_expires_at = None
+        self._devices_cache = None
+
+        # serializes token refreshes and re-authentication between the
+        # threads used by update(); reentrant as authenticating fetches
+        # the oauth token as well
+        self._auth_lock = threading.RLock()
+        self._auth_generation = 0
 
-        self.cache = CACHE_ATTRS
+        self.cache = deepcopy(CACHE_ATTRS)
         self.cache['account'] = self.username
         self.cache_file = cache_file
         self._reuse_session = reuse_session
 
+        # when lazy, connect on the first query instead
+        if not lazy:
+            self.connect()
+
+    def connect(self):
+        """Open the HTTP session and authenticate against Ring API."""
+        with self._auth_lock:
+            return self.__connect()
+
+    def __connect(self):
+        """Private method to connect, holding the auth lock."""
+        if self.session is not None:
+            self.session.close()
+
+        # multiplex concurrent queries over a single connection when
+        # asked to and httpx is installed, otherwise fall back to requests
+        if self._http2 and HTTP2Session.available():
+            self.session = HTTP2Session(timeout=self._timeout)
+        else:
+            self.session = requests.Session()
+
+            # keep connections to the Ring backend alive across queries;
+            # retries are handled by the query() loop itself
+            adapter = HTTPAdapter(pool_connections=POOL_CONNECTIONS,
+                                  pool_maxsize=POOL_MAXSIZE,
+                                  max_retries=0)
+            self.session.mount('https://', adapter)
+            self.session.mount('http://', adapter)
+
+        # a new session does not carry the bearer token yet, nor
+        # anything learned through the previous one
+        self._access_token = None
+        self._devices_cache = None
+        self.is_connected = None
+
         # tries to re-use old session
         if self._reuse_session:
             # self.cache['token'] = self.token
             self._process_cached_session()
         else:
             self._authenticate()
+        return self.is_connected
+
+    def _ensure_connected(self):
+        """Connect on first use when the Ring object was created lazily."""
+        if self.session is None:
+            with self._auth_lock:
+                # another thread may have connected while we were waiting
+                if self.session is None:
+                    self.__connect()
 
     def _process_cached_session(self):
         """Process cache_file to reuse token instead."""
@@ -92,6 +171,17 @@ class Ring(object):
                 if 'auth' in self.cache:
                     self.auth = self.cache['auth']
 
+                # skip probing the API while the cached oauth token is
+                # clearly valid, an expired session will answer the first
+                # query with a 401 and trigger a new authentication
+                expires_in = self.auth.get('expires_at', 0) - time.time() \
+                    if self.auth else 0
+                if expires_in > TOKEN_EXPIRY_MARGIN and \
+                   not self._persist_token:
+                    self._set_access_token(expires_in)
+                    self.is_connected = True
+                    return
+
                 # test if token from cache_file is still valid and functional
                 # if not, it should continue to get a new auth token
                 url = API_URI + DEVICES_ENDPOINT
@@ -106,7 +196,23 @@ class Ring(object):
 
     def _get_oauth_token(self):
         """Return Oauth Bearer token."""
-        # this token should be cached / saved for later
+        # reuse the bearer token until it is about to expire
+        if self._access_token_valid():
+            return self._access_token
+
+        with self._auth_lock:
+            # another thread may have refreshed it while we were waiting
+            if self._access_token_valid():
+                return self._access_token
+            return self._refresh_oauth_token()
+
+    def _access_token_valid(self):
+        """Return if the cached access token can still be used."""
+        return bool(self._access_token) and \
+            monotonic() < self._access_token_expires_at
+
+    def _refresh_oauth_token(self):
+        """Fetch or refresh the oauth token and return the bearer token."""
         oauth = Auth(self.auth)
 
         if not self.auth:
@@ -114,35 +220,54 @@ class Ring(object):
                 self.username,
                 self.password,
                 self.auth_callback)
+            self.last_refresh = monotonic()
         else:
+            refresh_at = 0
             if self.last_refresh:
-                expires_in = timedelta(seconds=self.auth['expires_in'])
-                refresh_at = self.last_refresh + expires_in
+                refresh_at = self.last_refresh + self.auth['expires_in']
 
                 if self.debug:
                     _LOGGER.debug("response from get oauth token %s",
                                   str(self.auth))
 
-            if not self.last_refresh or (dt.now() >= refresh_at):
+            if monotonic() >= refresh_at - TOKEN_EXPIRY_MARGIN:
                 self.auth = oauth.refresh_tokens()
-                self.last_refresh = dt.now()
+                self.last_refresh = monotonic()
             else:
                 if self.debug:
                     _LOGGER.debug("Reusing oauth token %s", str(self.auth))
 
-        return self.auth['access_token']
+        self._set_access_token(
+            self.last_refresh + self.auth['expires_in'] - monotonic())
+        return self._access_token
+
+    def _set_access_token(self, expires_in):
+        """Cache the oauth access token for the next expires_in seconds."""
+        if self._access_token != self.auth['access_token']:
+            self._access_token = self.auth['access_token']
+            # queries now need a bearer token or you'll get 401s, so
+            # mount it on the session to be sent along every request
+            self.session.headers['Authorization'] = \
+                'Bearer ' + self._access_token
+        self._access_token_expires_at = \
+            monotonic() + expires_in - TOKEN_EXPIRY_MARGIN
 
     def _authenticate(self, attempts=RETRY_TOKEN, session=None, wait=1.0):
         """Authenticate user against Ring API."""
+        with self._auth_lock:
+            return self.__authenticate(attempts, session, wait)
+
+    def __authenticate(self, attempts, session, wait):
+        """Private method to authenticate, holding the auth lock."""
         url = API_URI + NEW_SESSION_ENDPOINT
         loop = 0
-        # make a copy as we're mutating headers in the loop below
+        # make a copy as we're mutating headers below
         # which would cause issues with _get_oauth_token()
         # which expects a non mutated HEADERS copy
         modified_headers = HEADERS.copy()
+        modified_headers['Authorization'] = \
+            'Bearer ' + self._get_oauth_token()
         while loop <= attempts:
-            modified_headers['Authorization'] = \
-                'Bearer {}'.format(self._get_oauth_token())
             loop += 1
 
             try:
@@ -158,6 +283,13 @@ class Ring(object):
                 raise
 
             if not req:
+                # the bearer token was rejected, force a refresh before
+                # trying again
+                if req.status_code == 401:
+                    self.last_refresh = None
+                    self._access_token = None
+                    modified_headers['Authorization'] = \
+                        'Bearer ' + self._get_oauth_token()
                 time.sleep(wait)  # add a pause or you'll get rate limited
                 continue
 
@@ -173,6 +305,7 @@ class Ring(object):
                 self.is_connected = True
                 self.params = {'api_version': API_VERSION,
                                'auth_token': self.token}
+                self._auth_generation += 1
 
                 if self._persist_token and self._push_token_notify_url:
                     url = API_URI + PERSIST_TOKEN_ENDPOINT
@@ -183,8 +316,11 @@ class Ring(object):
                                            data=PERSIST_TOKEN_DATA,
                                            timeout=self._timeout)
 
-                # update token if reuse_session is True
-                if self._reuse_session:
+                # update token if reuse_session is True and it changed
+                cache_changed = (self.cache['account'] != self.username or
+                                 self.cache['token'] != self.token or
+                                 self.cache['auth'] != self.auth)
+                if self._reuse_session and cache_changed:
                     self.cache['account'] = self.username
                     self.cache['token'] = self.token
                     self.cache['auth'] = self.auth
@@ -215,43 +351,40 @@ class Ring(object):
         if self.debug:
             _LOGGER.debug("Querying %s", url)
 
+        self._ensure_connected()
+
         if self.debug and not self.is_connected:
-            _LOGGER.debug("Not connected. Refreshing token...")
-            self._authenticate()
+            with self._auth_lock:
+                if not self.is_connected:
+                    _LOGGER.debug("Not connected. Refreshing token...")
+                    self._authenticate()
 
-        # queries now need a bearer token or you'll get 401s
-        auth_header = {}
-        auth_header['Authorization'] = \
-            'Bearer {}'.format(self._get_oauth_token())
+        # refresh the bearer token mounted on the session if expired
+        self._get_oauth_token()
 
         response = None
         loop = 0
+        params = generation = None
         while loop <= attempts:
             if self.debug:
                 _LOGGER.debug("running query loop %s", loop)
 
-            # allow to override params when necessary
-            # and update self.params globally for the next connection
-            if extra_params:
-                params = self.params
-                params.update(extra_params)
-            else:
+            # allow to override params for this query only; they are
+            # merged once and again only if re-authenticating changed them
+            if params is None:
+                generation = self._auth_generation
                 params = self.params
+                if extra_params:
+                    params = dict(params)
+                    params.update(extra_params)
 
             loop += 1
             try:
-                if method == 'GET':
-                    req = self.session.get(
-                        (url), params=urlencode(params),
-                        headers=auth_header, timeout=query_timeout)
-                elif method == 'PUT':
-                    req = self.session.put(
-                        (url), params=urlencode(params),
-                        headers=auth_header, timeout=query_timeout)
-                elif method == 'POST':
-                    req = self.session.post(
-                        (url), params=urlencode(params), json=json,
-                        headers=auth_header, timeout=query_timeout)
+                # only POST requests carry a JSON body
+                req = self.session.request(
+                    method, (url), params=params,
+                    json=json if method == 'POST' else None,
+                    timeout=query_timeout)
 
                 if self.debug:
                     _LOGGER.debug("_query %s ret %s", loop, req.status_code)
@@ -262,81 +395,117 @@ class Ring(object):
 
             # if token is expired, refresh credentials and try again
             if req.status_code == 401:
-                self.is_connected = False
-                self._authenticate()
+                with self._auth_lock:
+                    # skip if another thread re-authenticated meanwhile
+                    if generation == self._auth_generation:
+                        self.is_connected = False
+                        self._authenticate()
+                params = None
                 continue
 
             if req.status_code == 200 or req.status_code == 204:
+                # changing settings makes the devices payload stale
+                if method != 'GET':
+                    self.invalidate_devices_cache()
+
                 # if raw, return session object otherwise return JSON
+                # (204 No Content has no body to be parsed)
                 if raw:
                     response = req
-                else:
-                    if method == 'GET':
+                elif method == 'GET' and req.status_code == 200:
+                    if orjson is not None:
+                        # pylint: disable=no-member
+                        response = orjson.loads(req.content)
+                    else:
                         response = req.json()
                 break
-
-        if self.debug and response is None:
-            _LOGGER.debug("%s", MSG_GENERIC_FAIL)
+        else:
+            # ran out of attempts without a successful response
+            if self.debug:
+                _LOGGER.debug("%s", MSG_GENERIC_FAIL)
         return response
 
     @property
     def devices(self):
         """Return all devices."""
-        devs = {}
-        devs['chimes'] = self.chimes
-        devs['stickup_cams'] = self.stickup_cams
-        devs['doorbells'] = self.doorbells
-        return devs
+        return self.__devices(self._DEVICE_SPECS)
+
+    def _fetch_devices_payload(self):
+        """Return the JSON listing all devices linked to the account."""
+        # reuse the last response for a few seconds since every device
+        # update() reads its attributes from the same payload
+        now = monotonic()
+        if self._devices_cache and \
+           now - self._devices_cache[0] < DEVICES_CACHE_TTL:
+            return self._devices_cache[1]
 
-    def __devices(self, device_type):
-        """Private method to query devices."""
-        lst = []
         url = API_URI + DEVICES_ENDPOINT
+        payload = self.query(url)
+        if payload is not None:
+            self._devices_cache = (now, payload)
+        return payload
+
+    def invalidate_devices_cache(self):
+        """Force the next devices lookup to query the Ring API."""
+        self._devices_cache = None
+
+    def __devices(self, device_types):
+        """Private method to query devices, grouped by device type."""
+        payload = self._fetch_devices_payload()
+        members = []
         try:
-            if device_type == 'stickup_cams':
-                req = self.query(url).get('stickup_cams')
-                for member in list((obj['description'] for obj in req)):
-                    lst.append(RingStickUpCam(self, member))
-
-            if device_type == 'chimes':
-                req = self.query(url).get('chimes')
-                for member in list((obj['description'] for obj in req)):
-                    lst.append(RingChime(self, member))
-
-            if device_type == 'doorbells':
-                req = self.query(url).get('doorbots')
-                for member in list((obj['description'] for obj in req)):
-                    lst.append(RingDoorBell(self, member))
-
-                # get shared doorbells, however device is read-only
-                req = self.query(url).get('authorized_doorbots')
-                for member in list((obj['description'] for obj in req)):
-                    lst.append(RingDoorBell(self, member, shared=True))
-
+            for device_type in device_types:
+                for key, device_class, kwargs in \
+                        self._DEVICE_SPECS[device_type]:
+                    members.extend(
+                        (device_type, device_class, obj['description'], kwargs)
+                        for obj in payload.get(key, []))
         except AttributeError:
             pass
-        return lst
+
+        def _create(member):
+            _, device_class, name, kwargs = member
+            try:
+                return device_class(self, name, **kwargs)
+            except AttributeError:
+                # a failed attributes query, skip the device
+                return None
+
+        # every device refreshes its attributes when created, which are
+        # independent requests, so create them concurrently when possible
+        if ThreadPoolExecutor is None or len(members) < 2:
+            devices = [_create(member) for member in members]
+        else:
+            with ThreadPoolExecutor(max_workers=UPDATE_WORKERS) as executor:
+                devices = list(executor.map(_create, members))
+
+        devs = dict((device_type, []) for device_type in device_types)
+        for member, device in zip(members, devices):
+            if device is not None:
+                devs[member[0]].append(device)
+        return devs
 
     @property
     def chimes(self):
         """Return a list of RingDoorChime objects."""
-        return self.__devices('chimes')
+        return self.__devices(('chimes',))['chimes']
 
     @property
     def stickup_cams(self):
         """Return a list of RingStickUpCam objects."""
-        return self.__devices('stickup_cams')
+        return self.__devices(('stickup_cams',))['stickup_cams']
 
     @property
     def doorbells(self):
         """Return a list of RingDoorBell objects."""
-        return self.__devices('doorbells')
+        return self.__devices(('doorbells',))['doorbells']
 
     def update(self):
         """Refreshes attributes for all linked devices."""
+        # creating the devices already refreshes each of them, so only
+        # make sure they are built from a fresh devices payload
+        self.invalidate_devices_cache()
         for device_lst in self.devices.values():
             for device in device_lst:
-                if hasattr(device, "update"):
-                    _LOGGER.debug("Updating attributes from %s", device.name)
-                    getattr(device, "update")
+                _LOGGER.debug("Updated attributes from %s", device.name)
         return True
@@ -21,9 +21,23 @@ class OAuth:
 # number of attempts to refresh token
 RETRY_TOKEN = 3
 
+# seconds before expiration to consider the oauth token stale
+TOKEN_EXPIRY_MARGIN = 60
+
 # timeout for HTTP requests
 TIMEOUT = 5
 
+# HTTP connection pool sizing, number of hosts to keep pools for
+# and maximum number of connections kept alive per host
+POOL_CONNECTIONS = 2
+POOL_MAXSIZE = 20
+
+# seconds to reuse the devices payload before querying it again
+DEVICES_CACHE_TTL = 10
+
+# number of devices created and refreshed concurrently
+UPDATE_WORKERS = 8
+
 # longer default timeout for recording downloads - typical video file sizes
 # are ~12 MB and empirical testing reveals a ~20 second download time over a
 # fast connection, suggesting speed is largely governed by capacity of Ring
@@ -94,7 +94,7 @@ class RingDoorBell(RingGeneric):
             self.alert = resp
             self.alert_expires_at = datetime.fromtimestamp(timestamp)
 
-            # save to a pickle data
+            # save to the cache file
             if self.alert:
                 _save_cache(self._ring.cache, self._ring.cache_file)
             return True
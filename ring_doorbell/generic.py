@@ -6,7 +6,7 @@ from datetime import datetime
 
 from ring_doorbell.utils import _locator, _save_cache
 from ring_doorbell.const import (
-    API_URI, DEVICES_ENDPOINT, NOT_FOUND,
+    API_URI, NOT_FOUND,
     HEALTH_CHIMES_ENDPOINT, HEALTH_DOORBELL_ENDPOINT)
 
 _LOGGER = logging.getLogger(__name__)
@@ -79,12 +79,13 @@ class RingGeneric(object):
 
     def _get_attrs(self):
         """Return attributes."""
-        url = API_URI + DEVICES_ENDPOINT
         try:
+            # pylint: disable=protected-access
+            payload = self._ring._fetch_devices_payload()
             if self.family == 'doorbots' and self.shared:
-                lst = self._ring.query(url).get('authorized_doorbots')
+                lst = payload.get('authorized_doorbots')
             else:
-                lst = self._ring.query(url).get(self.family)
+                lst = payload.get(self.family)
             index = _locator(lst, 'description', self.name)
             if index == NOT_FOUND:
                 return None
@@ -0,0 +1,91 @@
+# coding: utf-8
+# vim:sw=4:ts=4:et:
+"""Python Ring HTTP/2 session wrapper."""
+import requests
+
+try:
+    import httpx
+    import h2  # noqa: F401 pylint: disable=unused-import
+except ImportError:
+    httpx = None
+
+
+# pylint: disable=useless-object-inheritance
+class HTTP2Response(object):
+    """Expose a httpx response through the requests.Response interface."""
+
+    def __init__(self, response):
+        """Initialize HTTP/2 response.
+        :type response: httpx.Response
+        """
+        self._response = response
+
+    def __getattr__(self, name):
+        """Delegate everything else to the httpx response."""
+        return getattr(self._response, name)
+
+    def __bool__(self):
+        """Return True if status code is lower than 400."""
+        return self.ok
+
+    __nonzero__ = __bool__
+
+    @property
+    def ok(self):  # pylint: disable=invalid-name
+        """Return True if status code is lower than 400."""
+        return self._response.status_code < 400
+
+    @property
+    def url(self):
+        """Return the final URL as string."""
+        return str(self._response.url)
+
+    def raise_for_status(self):
+        """Raise requests.HTTPError for 4xx and 5xx responses."""
+        try:
+            self._response.raise_for_status()
+        except httpx.HTTPStatusError as err:
+            raise requests.exceptions.HTTPError(str(err), response=self)
+
+
+# pylint: disable=useless-object-inheritance
+class HTTP2Session(object):
+    """A requests.Session look-alike multiplexing requests over HTTP/2."""
+
+    def __init__(self, timeout):
+        """Initialize HTTP/2 session.
+        :type timeout: int
+        """
+        self._client = httpx.Client(http2=True, timeout=timeout)
+
+    @staticmethod
+    def available():
+        """Return if httpx with HTTP/2 support is installed."""
+        return httpx is not None
+
+    @property
+    def headers(self):
+        """Return headers sent along every request."""
+        return self._client.headers
+
+    def request(self, method, url, **kwargs):
+        """Send a request, raising requests exceptions on failures."""
+        try:
+            return HTTP2Response(self._client.request(
+                method, url, follow_redirects=True, **kwargs))
+        except httpx.TimeoutException as err:
+            raise requests.exceptions.Timeout(str(err))
+        except httpx.TransportError as err:
+            raise requests.exceptions.ConnectionError(str(err))
+
+    def post(self, url, **kwargs):
+        """Send a POST request."""
+        return self.request('POST', url, **kwargs)
+
+    def put(self, url, **kwargs):
+        """Send a PUT request."""
+        return self.request('PUT', url, **kwargs)
+
+    def close(self):
+        """Close all connections."""
+        self._client.close()
@@ -1,13 +1,23 @@
 # coding: utf-8
 # vim:sw=4:ts=4:et:
 """Python Ring Doorbell utils."""
+import json
 import os
+import tempfile
+from copy import deepcopy
 from ring_doorbell.const import CACHE_ATTRS, NOT_FOUND
 
 try:
-    import cPickle as pickle
+    from os import replace as _replace
 except ImportError:
-    import pickle
+    def _replace(src, dst):
+        """Rename src to dst, overwriting dst on Windows as well."""
+        try:
+            os.rename(src, dst)
+        except OSError:
+            # os.rename refuses to overwrite an existing file on Windows
+            os.remove(dst)
+            os.rename(src, dst)
 
 
 def _locator(lst, key, value):
@@ -20,40 +30,52 @@ def _locator(lst, key, value):
 
 
 def _clean_cache(filename):
-    """Remove filename if pickle version mismatch."""
+    """Remove filename if cache content is invalid."""
     if os.path.isfile(filename):
         os.remove(filename)
 
     # initialize cache since file was removed
-    initial_cache_data = CACHE_ATTRS
+    initial_cache_data = deepcopy(CACHE_ATTRS)
     _save_cache(initial_cache_data, filename)
     return initial_cache_data
 
 
 def _exists_cache(filename):
-    """Check if filename exists and if is pickle object."""
+    """Check if filename exists."""
     return bool(os.path.isfile(filename))
 
 
 def _save_cache(data, filename):
-    """Dump data into a pickle file."""
-    with open(filename, 'wb') as pickle_db:
-        pickle.dump(data, pickle_db)
+    """Dump data into a JSON file."""
+    # write to a unique temporary file first so an interrupted or
+    # concurrent write never leaves a truncated cache behind
+    fd, tmp_filename = tempfile.mkstemp(
+        dir=os.path.dirname(filename) or '.',
+        prefix=os.path.basename(filename) + '.', suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w') as json_db:
+            json.dump(data, json_db)
+        _replace(tmp_filename, filename)
+    finally:
+        if os.path.isfile(tmp_filename):
+            os.remove(tmp_filename)
     return True
 
 
 def _read_cache(filename):
-    """Read data from a pickle file."""
+    """Read data from a JSON file."""
     try:
         if os.path.isfile(filename):
-            data = pickle.load(open(filename, 'rb'))
+            with open(filename) as json_db:
+                data = json.load(json_db)
 
-            # make sure pickle obj has the expected defined keys
+            # make sure JSON obj has the expected defined keys
             # if not reinitialize cache
             if data.keys() != CACHE_ATTRS.keys():
                 raise EOFError
             return data
 
-    except (EOFError, ValueError):
+    # ValueError also covers caches left behind in the old pickle format
+    except (AttributeError, EOFError, ValueError):
         pass
     return _clean_cache(filename)
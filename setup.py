@@ -28,6 +28,9 @@ setup(
         'oauthlib==3.1.0',
         'pytz'
     ],
+    extras_require={
+        'http2': ['httpx[http2]'],
+    },
     test_suite='tests',
     keywords=[
         'ring',
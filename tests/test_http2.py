@@ -0,0 +1,146 @@
+# -*- coding: utf-8 -*-
+"""The tests http2.py for the Ring platform."""
+import functools
+import os
+import unittest
+from mock import patch
+import requests
+import requests_mock
+from ring_doorbell import Ring
+from ring_doorbell.http2 import HTTP2Session, httpx
+from tests.helpers import load_fixture
+
+USERNAME = 'foo'
+PASSWORD = 'bar'
+CACHE = os.path.join(os.path.dirname(__file__), 'cache_http2.db')
+
+
+@unittest.skipIf(httpx is None, 'httpx with HTTP/2 support is required')
+class TestHTTP2(unittest.TestCase):
+    """Test the HTTP/2 session against a mocked httpx transport."""
+
+    def setUp(self):
+        """Route httpx requests through handle() and mock oauth."""
+        self.requests = []
+        self.responses = {}
+
+        client = functools.partial(
+            httpx.Client, transport=httpx.MockTransport(self.handle))
+        self.patcher = patch('ring_doorbell.http2.httpx.Client', client)
+        self.patcher.start()
+
+        # the oauth token is still fetched by requests_oauthlib
+        self.mock = requests_mock.Mocker()
+        self.mock.start()
+        self.mock.post('https://oauth.ring.com/oauth/token',
+                       text=load_fixture('ring_oauth.json'))
+
+        self.set_response('POST', '/clients_api/session',
+                          (201, load_fixture('ring_session.json')))
+        self.set_response('PUT', '/clients_api/device', (204, ''))
+        self.set_response('GET', '/clients_api/ring_devices',
+                          (200, load_fixture('ring_devices.json')))
+
+    def tearDown(self):
+        """Stop everything started."""
+        self.patcher.stop()
+        self.mock.stop()
+        if os.path.isfile(CACHE):
+            os.remove(CACHE)
+
+    def set_response(self, method, path, *responses):
+        """Queue responses as (status_code, text) tuples or exceptions."""
+        self.responses[(method, path)] = list(responses)
+
+    def handle(self, request):
+        """Answer a httpx request with the queued response."""
+        self.requests.append(request)
+        queued = self.responses[(request.method, request.url.path)]
+        response = queued.pop(0) if len(queued) > 1 else queued[0]
+        if isinstance(response, Exception):
+            raise response
+        status_code, text = response
+        return httpx.Response(status_code, text=text)
+
+    def ring(self, **kwargs):
+        """Return a Ring object connected over HTTP/2."""
+        return Ring(USERNAME, PASSWORD, cache_file=CACHE, http2=True,
+                    **kwargs)
+
+    def test_authenticate(self):
+        """Test authentication goes through the HTTP/2 session."""
+        data = self.ring(persist_token=True)
+        self.assertIsInstance(data.session, HTTP2Session)
+        self.assertTrue(data.is_connected)
+        self.assertEqual('12345678910', data.token)
+
+        session, device = self.requests
+        self.assertEqual('/clients_api/session', session.url.path)
+        self.assertEqual('Bearer eyJ0eWfvEQwqfJNKyQ9999',
+                         session.headers['Authorization'])
+        self.assertIn(b'device%5Bos%5D=android', session.content)
+        self.assertEqual('PUT', device.method)
+        self.assertIn(b'auth_token=12345678910', device.content)
+
+    def test_query(self):
+        """Test queries carry the bearer header and session params."""
+        data = self.ring()
+        response = data.query('https://api.ring.com/clients_api/ring_devices',
+                              extra_params={'limit': 1})
+
+        self.assertEqual(1, len(response['chimes']))
+        request = self.requests[-1]
+        self.assertEqual('Bearer eyJ0eWfvEQwqfJNKyQ9999',
+                         request.headers['Authorization'])
+        self.assertEqual('12345678910', request.url.params['auth_token'])
+        self.assertEqual('1', request.url.params['limit'])
+
+    def test_query_reauthenticate(self):
+        """Test a 401 re-authenticates over the HTTP/2 session."""
+        data = self.ring()
+        self.set_response('GET', '/clients_api/ring_devices',
+                          (401, ''),
+                          (200, load_fixture('ring_devices.json')))
+
+        url = 'https://api.ring.com/clients_api/ring_devices'
+        self.assertIsNotNone(data.query(url))
+        paths = [request.url.path for request in self.requests]
+        self.assertEqual(['/clients_api/session',
+                          '/clients_api/ring_devices',
+                          '/clients_api/session',
+                          '/clients_api/ring_devices'], paths)
+
+    def test_response(self):
+        """Test responses behave like requests.Response."""
+        data = self.ring()
+        self.set_response('GET', '/missing', (404, ''))
+        url = 'https://api.ring.com/missing'
+
+        response = data.session.request('GET', url)
+        self.assertFalse(response)
+        self.assertFalse(response.ok)
+        self.assertEqual(404, response.status_code)
+        self.assertEqual(url, response.url)
+        self.assertRaises(requests.exceptions.HTTPError,
+                          response.raise_for_status)
+        self.assertIsNone(data.query(url, attempts=0, raw=True))
+
+        response = data.session.request(
+            'GET', 'https://api.ring.com/clients_api/ring_devices')
+        self.assertTrue(response)
+        self.assertIsNone(response.raise_for_status())
+        self.assertEqual(1, len(response.json()['chimes']))
+
+    def test_exceptions(self):
+        """Test httpx errors are raised as requests exceptions."""
+        data = self.ring()
+        url = 'https://api.ring.com/clients_api/ring_devices'
+
+        self.set_response('GET', '/clients_api/ring_devices',
+                          httpx.ConnectTimeout('timed out'))
+        self.assertRaises(requests.exceptions.Timeout, data.query, url)
+
+        self.set_response('GET', '/clients_api/ring_devices',
+                          httpx.ConnectError('refused'))
+        self.assertRaises(requests.exceptions.ConnectionError,
+                          data.query, url)
@@ -1,7 +1,16 @@
 # -*- coding: utf-8 -*-
 """The tests for the Ring platform."""
+import json
+import os
+import threading
+import time
 from datetime import datetime
-from tests.test_base import RingUnitTestBase
+from mock import patch
+import requests
+from ring_doorbell import Ring
+from ring_doorbell.const import CACHE_ATTRS, MSG_GENERIC_FAIL
+from ring_doorbell.utils import _save_cache
+from tests.test_base import RingUnitTestBase, USERNAME, PASSWORD, CACHE
 from tests.helpers import load_fixture
 import requests_mock
 
@@ -33,6 +42,12 @@ class TestRing(RingUnitTestBase):
         self.assertFalse(data._persist_token)
         self.assertEqual('http://localhost/', data._push_token_notify_url)
 
+    def test_cache_attrs_not_shared(self):
+        """Test the cache of an instance does not alias CACHE_ATTRS."""
+        self.assertIsNot(CACHE_ATTRS, self.ring.cache)
+        self.assertIsNone(CACHE_ATTRS['account'])
+        self.assertIsNone(CACHE_ATTRS['token'])
+
     @requests_mock.Mocker()
     def test_chime_attributes(self, mock):
         """Test the Ring Chime class and methods."""
@@ -207,3 +222,378 @@ class TestRing(RingUnitTestBase):
                 '/clients_api/doorbots/987652/siren_on',
                 history[3].path)
             self.assertEqual('30', history[3].qs['duration'][0])
+
+    @requests_mock.Mocker()
+    def test_oauth_token_reused(self, mock):
+        """Test the bearer token is cached between queries."""
+        mock.post('https://oauth.ring.com/oauth/token',
+                  text=load_fixture('ring_oauth.json'))
+        mock.get('https://api.ring.com/clients_api/ring_devices',
+                 text=load_fixture('ring_devices.json'))
+
+        data = self.ring
+        data.query('https://api.ring.com/clients_api/ring_devices')
+        data.query('https://api.ring.com/clients_api/ring_devices')
+
+        history = list(filter(lambda x: x.hostname == 'oauth.ring.com',
+                              mock.request_history))
+        self.assertEqual(0, len(history))
+        self.assertEqual('Bearer eyJ0eWfvEQwqfJNKyQ9999',
+                         mock.last_request.headers['Authorization'])
+
+    @requests_mock.Mocker()
+    def test_devices_payload_cached(self, mock):
+        """Test the devices payload is queried once and reused."""
+        mock.post('https://oauth.ring.com/oauth/token',
+                  text=load_fixture('ring_oauth.json'))
+        mock.get('https://api.ring.com/clients_api/ring_devices',
+                 text=load_fixture('ring_devices.json'))
+        mock.get('https://api.ring.com/clients_api/chimes/999999/health',
+                 text=load_fixture('ring_chime_health_attrs.json'))
+        mock.get('https://api.ring.com/clients_api/doorbots/987652/health',
+                 text=load_fixture('ring_doorboot_health_attrs.json'))
+        mock.get('https://api.ring.com/clients_api/doorbots/987653/health',
+                 text=load_fixture('ring_doorboot_health_attrs_id987653.json'))
+
+        def devices_queries():
+            return len(list(filter(
+                lambda x: x.path == '/clients_api/ring_devices',
+                mock.request_history)))
+
+        data = self.ring
+        data.invalidate_devices_cache()
+        devs = data.devices
+        self.assertEqual(1, len(devs['chimes']))
+        self.assertEqual(2, len(devs['doorbells']))
+        self.assertEqual(1, len(devs['stickup_cams']))
+        self.assertEqual(1, devices_queries())
+
+        data.invalidate_devices_cache()
+        self.assertEqual(1, len(data.chimes))
+        self.assertEqual(2, devices_queries())
+
+    @requests_mock.Mocker()
+    def test_query_extra_params(self, mock):
+        """Test extra params are not kept for the following queries."""
+        mock.post('https://oauth.ring.com/oauth/token',
+                  text=load_fixture('ring_oauth.json'))
+        mock.put(requests_mock.ANY, text='ok')
+
+        data = self.ring
+        url = 'https://api.ring.com/clients_api/doorbots/987652/siren_on'
+        data.query(url, extra_params={'duration': 30}, method='PUT')
+        self.assertEqual('30', mock.last_request.qs['duration'][0])
+        self.assertNotIn('duration', data.params)
+
+        data.query(url, method='PUT')
+        self.assertNotIn('duration', mock.last_request.qs)
+
+    @requests_mock.Mocker()
+    def test_query_no_content(self, mock):
+        """Test a 204 No Content response is not parsed as JSON."""
+        mock.post('https://oauth.ring.com/oauth/token',
+                  text=load_fixture('ring_oauth.json'))
+        mock.get('https://api.ring.com/clients_api/dings/active',
+                 status_code=204)
+
+        data = self.ring
+        url = 'https://api.ring.com/clients_api/dings/active'
+        self.assertIsNone(data.query(url))
+        self.assertEqual(204, data.query(url, raw=True).status_code)
+
+    @requests_mock.Mocker()
+    def test_query_generic_fail_logged(self, mock):
+        """Test the failure message is only logged when attempts run out."""
+        mock.post('https://oauth.ring.com/oauth/token',
+                  text=load_fixture('ring_oauth.json'))
+        mock.get('https://api.ring.com/clients_api/dings/active',
+                 status_code=204)
+        mock.get('https://api.ring.com/clients_api/missing',
+                 status_code=404)
+
+        data = self.ring
+        data.debug = True
+        with patch('ring_doorbell._LOGGER') as logger:
+            data.query('https://api.ring.com/clients_api/dings/active')
+            self.assertNotIn(('%s', MSG_GENERIC_FAIL),
+                             [c[0] for c in logger.debug.call_args_list])
+
+            data.query('https://api.ring.com/clients_api/missing')
+            self.assertIn(('%s', MSG_GENERIC_FAIL),
+                          [c[0] for c in logger.debug.call_args_list])
+
+    @requests_mock.Mocker()
+    def test_query_orjson(self, mock):
+        """Test JSON bodies are decoded with orjson when available."""
+        mock.post('https://oauth.ring.com/oauth/token',
+                  text=load_fixture('ring_oauth.json'))
+        mock.get('https://api.ring.com/clients_api/ring_devices',
+                 text=load_fixture('ring_devices.json'))
+
+        data = self.ring
+        url = 'https://api.ring.com/clients_api/ring_devices'
+        expected = json.loads(load_fixture('ring_devices.json'))
+
+        with patch('ring_doorbell.orjson') as orjson:
+            orjson.loads.side_effect = json.loads
+            self.assertEqual(expected, data.query(url))
+            orjson.loads.assert_called_once_with(
+                load_fixture('ring_devices.json').encode('utf-8'))
+
+        with patch('ring_doorbell.orjson', None):
+            self.assertEqual(expected, data.query(url))
+
+    @requests_mock.Mocker()
+    def test_cached_session_reused(self, mock):
+        """Test a fresh cached token skips the devices probe."""
+
+        auth = json.loads(load_fixture('ring_oauth.json'))
+        auth['expires_at'] = time.time() + auth['expires_in']
+        _save_cache({'account': USERNAME, 'alerts': None,
+                     'token': '12345678910', 'auth': auth}, CACHE)
+
+        data = Ring(USERNAME, PASSWORD, cache_file=CACHE)
+        self.assertTrue(data.is_connected)
+        self.assertEqual('12345678910', data.params['auth_token'])
+        self.assertEqual(0, len(mock.request_history))
+
+    @requests_mock.Mocker()
+    def test_update(self, mock):
+        """Test update refreshes every device."""
+        mock.post('https://oauth.ring.com/oauth/token',
+                  text=load_fixture('ring_oauth.json'))
+        mock.get('https://api.ring.com/clients_api/ring_devices',
+                 text=load_fixture('ring_devices.json'))
+        mock.get('https://api.ring.com/clients_api/chimes/999999/health',
+                 text=load_fixture('ring_chime_health_attrs.json'))
+        mock.get('https://api.ring.com/clients_api/doorbots/987652/health',
+                 text=load_fixture('ring_doorboot_health_attrs.json'))
+        mock.get('https://api.ring.com/clients_api/doorbots/987653/health',
+                 text=load_fixture('ring_doorboot_health_attrs_id987653.json'))
+
+        data = self.ring
+        self.assertTrue(data.update())
+
+        # every device is refreshed once, from a single devices payload
+        history = list(filter(lambda x: x.path.endswith('/health'),
+                              mock.request_history))
+        self.assertEqual(4, len(history))
+        history = list(filter(
+            lambda x: x.path == '/clients_api/ring_devices',
+            mock.request_history))
+        self.assertEqual(1, len(history))
+
+    @requests_mock.Mocker()
+    def test_doorbells_single_query(self, mock):
+        """Test owned and shared doorbells come from a single query."""
+        mock.post('https://oauth.ring.com/oauth/token',
+                  text=load_fixture('ring_oauth.json'))
+        mock.get('https://api.ring.com/clients_api/ring_devices',
+                 text=load_fixture('ring_devices.json'))
+        mock.get('https://api.ring.com/clients_api/doorbots/987652/health',
+                 text=load_fixture('ring_doorboot_health_attrs.json'))
+        mock.get('https://api.ring.com/clients_api/doorbots/987653/health',
+                 text=load_fixture('ring_doorboot_health_attrs_id987653.json'))
+
+        data = self.ring
+        data.invalidate_devices_cache()
+        doorbells = data.doorbells
+        self.assertEqual([False, True], [dev.shared for dev in doorbells])
+
+        history = list(filter(
+            lambda x: x.path == '/clients_api/ring_devices',
+            mock.request_history))
+        self.assertEqual(1, len(history))
+
+    @requests_mock.Mocker()
+    def test_authenticate_refresh_on_401(self, mock):
+        """Test a rejected bearer token is refreshed once."""
+        mock.post('https://oauth.ring.com/oauth/token',
+                  text=load_fixture('ring_oauth.json'))
+        mock.post('https://api.ring.com/clients_api/session',
+                  [{'status_code': 401},
+                   {'text': load_fixture('ring_session.json')}])
+
+        data = self.ring
+        self.assertTrue(data._authenticate(wait=0))
+        self.assertTrue(data.is_connected)
+
+        history = list(filter(lambda x: x.hostname == 'oauth.ring.com',
+                              mock.request_history))
+        self.assertEqual(1, len(history))
+
+    @requests_mock.Mocker()
+    def test_cache_not_rewritten(self, mock):
+        """Test the cache file is only written when the tokens change."""
+        mock.post('https://api.ring.com/clients_api/session',
+                  text=load_fixture('ring_session.json'))
+
+        data = self.ring
+        os.remove(CACHE)
+        self.assertTrue(data._authenticate())
+        self.assertFalse(os.path.isfile(CACHE))
+
+    @requests_mock.Mocker()
+    def test_http2_fallback(self, mock):
+        """Test http2 falls back to requests when httpx is missing."""
+        mock.post('https://oauth.ring.com/oauth/token',
+                  text=load_fixture('ring_oauth.json'))
+        mock.post('https://api.ring.com/clients_api/session',
+                  text=load_fixture('ring_session.json'))
+
+        with patch('ring_doorbell.http2.httpx', None):
+            data = Ring(USERNAME, PASSWORD, cache_file=CACHE,
+                        reuse_session=False, http2=True)
+        self.assertIsInstance(data.session, requests.Session)
+        self.assertTrue(data.is_connected)
+
+    @requests_mock.Mocker()
+    def test_lazy_connect(self, mock):
+        """Test a lazy Ring object connects on its first query."""
+        mock.post('https://oauth.ring.com/oauth/token',
+                  text=load_fixture('ring_oauth.json'))
+        mock.get('https://api.ring.com/clients_api/ring_devices',
+                 text=load_fixture('ring_devices.json'))
+        mock.post('https://api.ring.com/clients_api/session',
+                  text=load_fixture('ring_session.json'))
+
+        data = Ring(USERNAME, PASSWORD, cache_file=CACHE, lazy=True)
+        self.assertIsNone(data.session)
+        self.assertIsNone(data.is_connected)
+        self.assertEqual(0, len(mock.request_history))
+
+        self.assertIsNotNone(
+            data.query('https://api.ring.com/clients_api/ring_devices'))
+        self.assertTrue(data.is_connected)
+        self.assertEqual('Bearer eyJ0eWfvEQwqfJNKyQ9999',
+                         mock.last_request.headers['Authorization'])
+
+    def _run_concurrently(self, target, count=4):
+        """Run target from count threads at once and wait for them."""
+        threads = [threading.Thread(target=target) for _ in range(count)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    @requests_mock.Mocker()
+    def test_concurrent_token_refresh(self, mock):
+        """Test an expired token is refreshed once by concurrent queries."""
+        def oauth(request, context):
+            time.sleep(0.05)
+            return load_fixture('ring_oauth.json')
+
+        mock.post('https://oauth.ring.com/oauth/token', text=oauth)
+        mock.get('https://api.ring.com/clients_api/ring_devices',
+                 text=load_fixture('ring_devices.json'))
+
+        data = self.ring
+        data.last_refresh = None
+        data._access_token_expires_at = 0
+        self._run_concurrently(lambda: data.query(
+            'https://api.ring.com/clients_api/ring_devices'))
+
+        history = list(filter(lambda x: x.hostname == 'oauth.ring.com',
+                              mock.request_history))
+        self.assertEqual(1, len(history))
+
+    @requests_mock.Mocker()
+    def test_concurrent_lazy_connect(self, mock):
+        """Test concurrent first queries on a lazy Ring connect once."""
+        def session(request, context):
+            time.sleep(0.05)
+            return load_fixture('ring_session.json')
+
+        mock.post('https://oauth.ring.com/oauth/token',
+                  text=load_fixture('ring_oauth.json'))
+        mock.post('https://api.ring.com/clients_api/session', text=session)
+        mock.get('https://api.ring.com/clients_api/ring_devices',
+                 text=load_fixture('ring_devices.json'))
+
+        def new_session():
+            time.sleep(0.05)
+            return session_class()
+
+        session_class = requests.Session
+        data = Ring(USERNAME, PASSWORD, cache_file=CACHE,
+                    reuse_session=False, lazy=True)
+        results = []
+        with patch('ring_doorbell.requests.Session', new_session):
+            self._run_concurrently(lambda: results.append(data.query(
+                'https://api.ring.com/clients_api/ring_devices')))
+
+        self.assertEqual(4, len([r for r in results if r is not None]))
+        history = list(filter(
+            lambda x: x.path == '/clients_api/session',
+            mock.request_history))
+        self.assertEqual(1, len(history))
+
+    @requests_mock.Mocker()
+    def test_concurrent_reauthenticate(self, mock):
+        """Test concurrent 401 responses re-authenticate only once."""
+        def session(request, context):
+            time.sleep(0.05)
+            context.status_code = 201
+            return load_fixture('ring_session.json')
+
+        def devices(request, context):
+            if request.qs.get('auth_token') != ['12345678910']:
+                context.status_code = 401
+                return ''
+            return load_fixture('ring_devices.json')
+
+        mock.post('https://oauth.ring.com/oauth/token',
+                  text=load_fixture('ring_oauth.json'))
+        mock.post('https://api.ring.com/clients_api/session', text=session)
+        mock.get('https://api.ring.com/clients_api/ring_devices',
+                 text=devices)
+
+        data = self.ring
+        data.params = {'api_version': '9', 'auth_token': 'expired'}
+        results = []
+        self._run_concurrently(lambda: results.append(data.query(
+            'https://api.ring.com/clients_api/ring_devices')))
+
+        self.assertEqual(4, len([r for r in results if r is not None]))
+        history = list(filter(
+            lambda x: x.path == '/clients_api/session',
+            mock.request_history))
+        self.assertEqual(1, len(history))
+
+    @requests_mock.Mocker()
+    def test_reconnect_resets_state(self, mock):
+        """Test connect() drops state from the previous session."""
+        mock.post('https://oauth.ring.com/oauth/token',
+                  text=load_fixture('ring_oauth.json'))
+
+        data = self.ring
+        data._devices_cache = (time.time(), {'chimes': []})
+        with patch.object(data, '_process_cached_session',
+                          side_effect=requests.exceptions.ConnectionError):
+            self.assertRaises(requests.exceptions.ConnectionError,
+                              data.connect)
+        self.assertIsNone(data._devices_cache)
+        self.assertIsNone(data.is_connected)
+
+    @requests_mock.Mocker()
+    def test_devices_health_failure(self, mock):
+        """Test a device failing to refresh does not drop the others."""
+        mock.post('https://oauth.ring.com/oauth/token',
+                  text=load_fixture('ring_oauth.json'))
+        mock.get('https://api.ring.com/clients_api/ring_devices',
+                 text=load_fixture('ring_devices.json'))
+        mock.get('https://api.ring.com/clients_api/chimes/999999/health',
+                 text=load_fixture('ring_chime_health_attrs.json'))
+        mock.get('https://api.ring.com/clients_api/doorbots/987652/health',
+                 status_code=500)
+        mock.get('https://api.ring.com/clients_api/doorbots/987653/health',
+                 text=load_fixture('ring_doorboot_health_attrs_id987653.json'))
+
+        data = self.ring
+        data.invalidate_devices_cache()
+        devs = data.devices
+        self.assertEqual(1, len(devs['chimes']))
+        self.assertEqual([987653],
+                         [dev.account_id for dev in devs['doorbells']])
+        self.assertEqual([], devs['stickup_cams'])
+        self.assertTrue(data.update())
@@ -1,7 +1,10 @@
 """The tests utils.py for the Ring platform."""
+import glob
 import os
-import sys
+import pickle
+import threading
 import unittest
+from mock import patch
 from ring_doorbell.utils import (
     _locator, _clean_cache, _exists_cache, _save_cache, _read_cache)
 from ring_doorbell.const import CACHE_ATTRS
@@ -58,10 +61,53 @@ class TestUtils(unittest.TestCase):
         self.assertIsInstance(_read_cache(CACHE), dict)
         self.cleanup()
 
+    def test_read_cache_pickle(self):
+        """Test _read_cache with a cache left in the old pickle format."""
+        with open(CACHE, 'wb') as pickle_db:
+            pickle.dump(CACHE_ATTRS, pickle_db)
+        self.assertEqual(CACHE_ATTRS, _read_cache(CACHE))
+        self.cleanup()
+
+    def test_save_cache_atomic(self):
+        """Test _save_cache does not leave its temporary file behind."""
+        self.assertTrue(_save_cache(CACHE_ATTRS, CACHE))
+        self.assertEqual([], glob.glob(CACHE + '.*.tmp'))
+        self.assertEqual(CACHE_ATTRS, _read_cache(CACHE))
+        self.cleanup()
+
+    def test_save_cache_concurrent(self):
+        """Test concurrent _save_cache calls do not clash."""
+        errors = []
+
+        def save():
+            try:
+                for _ in range(20):
+                    _save_cache(CACHE_ATTRS, CACHE)
+            except (IOError, OSError) as error:
+                errors.append(error)
+
+        threads = [threading.Thread(target=save) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual([], errors)
+        self.assertEqual([], glob.glob(CACHE + '.*.tmp'))
+        self.assertEqual(CACHE_ATTRS, _read_cache(CACHE))
+        self.cleanup()
+
+    def test_save_cache_failure(self):
+        """Test a failed _save_cache keeps the previous cache."""
+        self.assertTrue(_save_cache(CACHE_ATTRS, CACHE))
+        with patch('ring_doorbell.utils.json.dump',
+                   side_effect=TypeError):
+            self.assertRaises(TypeError, _save_cache, DATA, CACHE)
+        self.assertEqual([], glob.glob(CACHE + '.*.tmp'))
+        self.assertEqual(CACHE_ATTRS, _read_cache(CACHE))
+        self.cleanup()
+
     def test_general_exceptions(self):
         """Test exception triggers on utils.py"""
         self.assertRaises(TypeError, _clean_cache, True)
-        if sys.version_info.major == 2:
-            self.assertRaises(TypeError, _read_cache, True)
-        else:
-            self.assertRaises(OSError, _read_cache, True)
+        self.assertRaises(TypeError, _read_cache, True)